@@ -7,6 +7,14 @@ from pathlib import Path
 from PIL import Image
 
 
+ICO_SIZES = [(16, 16), (24, 24), (32, 32), (48, 48), (64, 64), (128, 128), (256, 256)]
+
+
+def build_icon_frames(image, sizes):
+    """Resize the source once per icon size, largest first, to exactly that size."""
+    return [image.resize(size, Image.Resampling.LANCZOS) for size in sorted(sizes, reverse=True)]
+
+
 def convert_png_to_ico(input_file, output_file):
     input_path = Path(input_file)
     output_path = Path(output_file)
@@ -18,10 +26,13 @@ def convert_png_to_ico(input_file, output_file):
 
     with Image.open(input_path) as image:
         image = image.convert("RGBA")
-        image.save(
+        # Largest frame first; Pillow uses provided frames as-is when their size matches
+        frames = build_icon_frames(image, ICO_SIZES)
+        frames[0].save(
             output_path,
             format="ICO",
-            sizes=[(16, 16), (24, 24), (32, 32), (48, 48), (64, 64), (128, 128), (256, 256)],
+            sizes=ICO_SIZES,
+            append_images=frames[1:],
         )
 
 
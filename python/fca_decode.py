@@ -11,9 +11,16 @@ import struct
 import os
 import hashlib
 import json
+import mmap
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-import requests
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Enable UTF-8 output on Windows console
 if sys.platform == 'win32':
@@ -31,10 +38,28 @@ from constants import (
     FILE_TYPE_LEGO_DIMENSIONS,
 )
 
+# Precompiled big-endian record prefix: total size (4 bytes) + header size (2 bytes)
+_RECORD_PREFIX = struct.Struct('>IH')
+
+# Archives smaller than this are read in one call; mapping them costs more than it saves
+_MMAP_MIN_SIZE = 1 << 20
+
+# Flags for creating extracted files (O_BINARY only exists on Windows)
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+
+# Translation table replacing invalid filename characters (including / and \) with '_'
+_INVALID_FILENAME_CHARS = str.maketrans({char: '_' for char in '<>:"|?*/\\'})
+
+# Hash algorithms for naming extracted files without an amiibo name
+NAME_HASH_ALGORITHMS = ("md5", "blake2b")
+
 # Global cache for amiibo database
 _AMIIBO_DATABASE = None
 _DATABASE_LOAD_ATTEMPTED = False
 
+# Parsed database files keyed by resolved path: {path: (mtime_ns, database, index)}
+_DATABASE_FILE_CACHE = {}
+
 # File type names mapping
 FILE_TYPE_NAMES = {
     FILE_TYPE_UNKNOWN: "Unknown",
@@ -51,6 +76,44 @@ def get_file_type_name(file_type):
     return FILE_TYPE_NAMES.get(file_type, f"Reserved ({file_type})")
 
 
+def parse_json_bytes(raw):
+    """
+    Parse a JSON document from bytes, using orjson when it is installed.
+    
+    Args:
+        raw: UTF-8 encoded JSON bytes
+        
+    Returns:
+        The parsed JSON value
+    """
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _load_database_file(db_path):
+    """
+    Parse a database JSON file, reusing the cached result while the file is unchanged.
+    
+    Args:
+        db_path: Path object for an existing database file
+        
+    Returns:
+        Dictionary with amiibo data
+    """
+    cache_key = str(db_path.resolve())
+    mtime_ns = db_path.stat().st_mtime_ns
+    
+    cached = _DATABASE_FILE_CACHE.get(cache_key)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+    
+    database = parse_json_bytes(db_path.read_bytes())
+    _DATABASE_FILE_CACHE[cache_key] = (mtime_ns, database, _build_amiibo_index(database))
+    print(f"Loaded amiibo database from: {db_path}")
+    return database
+
+
 def load_amiibo_database(custom_database_path=None):
     """
     Load the amiibo database from local file if available.
@@ -63,15 +126,12 @@ def load_amiibo_database(custom_database_path=None):
     """
     global _AMIIBO_DATABASE, _DATABASE_LOAD_ATTEMPTED
     
-    # If custom database specified, don't use cache
+    # Custom database is cached per file (path + mtime), not in the global slot
     if custom_database_path:
         try:
             db_path = Path(custom_database_path)
             if db_path.is_file():
-                with open(db_path, 'r', encoding='utf-8') as f:
-                    database = json.load(f)
-                    print(f"Loaded amiibo database from: {db_path}")
-                    return database
+                return _load_database_file(db_path)
             else:
                 print(f"Custom database file not found: {db_path}")
                 return None
@@ -95,10 +155,8 @@ def load_amiibo_database(custom_database_path=None):
         
         for db_path in possible_paths:
             if db_path.is_file():
-                with open(db_path, 'r', encoding='utf-8') as f:
-                    _AMIIBO_DATABASE = json.load(f)
-                    print(f"Loaded amiibo database from: {db_path}")
-                    return _AMIIBO_DATABASE
+                _AMIIBO_DATABASE = _load_database_file(db_path)
+                return _AMIIBO_DATABASE
     except Exception as e:
         # Silently continue if database can't be loaded
         pass
@@ -114,7 +172,7 @@ def extract_amiibo_id(content):
     Tail: bytes 0x58-0x5B (4 bytes = 8 hex chars)
     
     Args:
-        content: The file content bytes
+        content: The file content (bytes or memoryview)
         
     Returns:
         A tuple of (head_id, tail_id) as hex strings, or (None, None) if not found
@@ -127,7 +185,7 @@ def extract_amiibo_id(content):
         tail_bytes = content[0x58:0x5C]
         
         # Ensure tail is not all zeros (some amiibo have head=00000000 but valid tail)
-        if any(b != 0 for b in tail_bytes):
+        if int.from_bytes(tail_bytes, 'big'):
             head_id = head_bytes.hex()
             tail_id = tail_bytes.hex()
             return head_id, tail_id
@@ -137,6 +195,45 @@ def extract_amiibo_id(content):
     return None, None
 
 
+def _build_amiibo_index(database):
+    """
+    Build head+tail and tail-only lookup dictionaries for a database.
+    
+    Args:
+        database: Dictionary with amiibo data (as loaded from JSON)
+        
+    Returns:
+        A tuple of ({(head, tail): amiibo}, {tail: amiibo}); the first entry
+        in database order wins when IDs repeat
+    """
+    by_head_tail = {}
+    by_tail = {}
+    for amiibo in database.get("amiibo", []):
+        head = amiibo.get("head")
+        tail = amiibo.get("tail")
+        by_head_tail.setdefault((head, tail), amiibo)
+        by_tail.setdefault(tail, amiibo)
+    return by_head_tail, by_tail
+
+
+def get_amiibo_index(database):
+    """
+    Get head+tail and tail-only lookup dictionaries for a loaded database.
+    Databases loaded from a file reuse the index cached alongside them in
+    _DATABASE_FILE_CACHE; any other dictionary is indexed on the fly.
+    
+    Args:
+        database: Dictionary with amiibo data (as loaded from JSON)
+        
+    Returns:
+        A tuple of ({(head, tail): amiibo}, {tail: amiibo})
+    """
+    for cached in _DATABASE_FILE_CACHE.values():
+        if cached[1] is database:
+            return cached[2]
+    return _build_amiibo_index(database)
+
+
 def lookup_amiibo_data(head_id=None, tail_id=None, custom_database_path=None):
     """
     Lookup amiibo information from local database only.
@@ -158,23 +255,20 @@ def lookup_amiibo_data(head_id=None, tail_id=None, custom_database_path=None):
     # Try local database only (no online API calls)
     db = load_amiibo_database(custom_database_path=custom_database_path)
     if db:
-        amiibo_list = db.get("amiibo", [])
-        
-        # Search by head+tail in database
-        for amiibo in amiibo_list:
-            if amiibo.get("head") == head_id and amiibo.get("tail") == tail_id:
-                series_name = amiibo.get("amiiboSeries", "Unknown")
-                amiibo_type = amiibo.get("type", "Unknown")
-                amiibo_name = amiibo.get("name", "Unknown")
-                return series_name, amiibo_type, amiibo_name, "database_head+tail"
-        
-        # Search by tail only in database
-        for amiibo in amiibo_list:
-            if amiibo.get("tail") == tail_id:
-                series_name = amiibo.get("amiiboSeries", "Unknown")
-                amiibo_type = amiibo.get("type", "Unknown")
-                amiibo_name = amiibo.get("name", "Unknown")
-                return series_name, amiibo_type, amiibo_name, "database_tail"
+        by_head_tail, by_tail = get_amiibo_index(db)
+        
+        # Search by head+tail, then by tail only
+        amiibo = by_head_tail.get((head_id, tail_id))
+        lookup_method = "database_head+tail"
+        if amiibo is None:
+            amiibo = by_tail.get(tail_id)
+            lookup_method = "database_tail"
+        
+        if amiibo is not None:
+            series_name = amiibo.get("amiiboSeries", "Unknown")
+            amiibo_type = amiibo.get("type", "Unknown")
+            amiibo_name = amiibo.get("name", "Unknown")
+            return series_name, amiibo_type, amiibo_name, lookup_method
     
     # Database not available or amiibo not found - return None (will use MD5 fallback)
     return None, None, None, "not_found"
@@ -191,9 +285,7 @@ def sanitize_filename(filename):
         A sanitized filename safe for file systems
     """
     # Replace invalid filename characters (including path separators / and \)
-    invalid_chars = '<>:"|?*/\\'
-    for char in invalid_chars:
-        filename = filename.replace(char, '_')
+    filename = filename.translate(_INVALID_FILENAME_CHARS)
     
     # Remove leading/trailing spaces and dots
     filename = filename.strip(' .')
@@ -205,18 +297,58 @@ def sanitize_filename(filename):
     return filename
 
 
-def download_amiibo_database_to_script_dir(force=False):
+def _read_download_meta(meta_path, db_path):
     """
-    Download the amiibo database from amiiboapi.org and save to script directory.
+    Read the HTTP validators saved by the last database download.
+    
+    Args:
+        meta_path: Path object for the metadata file
+        db_path: Path object for the database file the metadata describes
+        
+    Returns:
+        Dictionary with "etag" and "last_modified" keys, or an empty dict if the
+        metadata is missing or the database was changed since it was written
+    """
+    try:
+        meta = json.loads(meta_path.read_text(encoding='utf-8'))
+        if meta.get("mtime_ns") == db_path.stat().st_mtime_ns:
+            return meta
+    except Exception:
+        pass
+    return {}
+
+
+def _write_download_meta(meta_path, db_path, etag, last_modified):
+    """Save HTTP validators for a freshly downloaded database; failures are silently ignored."""
+    try:
+        meta = {
+            "etag": etag,
+            "last_modified": last_modified,
+            "mtime_ns": db_path.stat().st_mtime_ns,
+        }
+        meta_path.write_text(json.dumps(meta), encoding='utf-8')
+    except Exception:
+        pass
+
+
+def download_amiibo_database_file(db_path, force=False):
+    """
+    Download the amiibo database from amiiboapi.org and save it to db_path.
     
     Args:
-        force: If True, re-download even if the file already exists
+        db_path: Path object for the database JSON file to write
+        force: If True, refresh an existing file. The request is conditional on the
+            ETag/Last-Modified saved from the previous download, so an unchanged
+            database is not transferred again.
         
     Returns:
         True if successful, False otherwise
     """
     try:
-        db_path = Path(__file__).with_name("amiibo_database.json")
+        # Imported here so encode/decode runs don't pay for loading requests
+        import requests
+        
+        meta_path = db_path.with_name(db_path.name + ".meta")
         
         # Check if file exists and skip if not forcing
         if db_path.is_file() and not force:
@@ -225,22 +357,47 @@ def download_amiibo_database_to_script_dir(force=False):
         
         print(f"Downloading amiibo database from amiiboapi.org...")
         url = "https://amiiboapi.org/api/amiibo/"
-        response = requests.get(url, timeout=30)
-        
-        if response.status_code != 200:
-            print(f"Error: API returned status code {response.status_code}")
-            return False
+        part_path = db_path.with_name(db_path.name + ".part")
         
-        data = response.json()
-        amiibo_list = data.get("amiibo", [])
+        # Conditional request headers from the previous download, if it is still on disk
+        headers = {}
+        meta = _read_download_meta(meta_path, db_path)
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
         
-        if not amiibo_list:
-            print("Error: No amiibo data received from API")
-            return False
+        try:
+            # Stream the response body straight to disk instead of re-serializing it
+            with requests.get(url, timeout=30, stream=True, headers=headers) as response:
+                if response.status_code == 304:
+                    print(f"Database is already up to date: {db_path}")
+                    return True
+                
+                if response.status_code != 200:
+                    print(f"Error: API returned status code {response.status_code}")
+                    return False
+                
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+                
+                with open(part_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=65536):
+                        f.write(chunk)
+            
+            # Validate the download before replacing any existing database
+            amiibo_list = parse_json_bytes(part_path.read_bytes()).get("amiibo", [])
+            
+            if not amiibo_list:
+                print("Error: No amiibo data received from API")
+                return False
+            
+            os.replace(part_path, db_path)
+        finally:
+            if part_path.exists():
+                part_path.unlink()
         
-        # Save to file
-        with open(db_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        _write_download_meta(meta_path, db_path, etag, last_modified)
         
         print(f"Downloaded {len(amiibo_list)} amiibo entries (~{db_path.stat().st_size / 1024 / 1024:.2f} MB)")
         print(f"Saved to: {db_path}")
@@ -251,35 +408,137 @@ def download_amiibo_database_to_script_dir(force=False):
         return False
 
 
-def make_unique_filename(output_file):
+def download_amiibo_database_to_script_dir(force=False):
+    """
+    Download the amiibo database from amiiboapi.org and save to script directory.
+    
+    Args:
+        force: If True, refresh an existing file (see download_amiibo_database_file)
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    return download_amiibo_database_file(Path(__file__).with_name("amiibo_database.json"), force=force)
+
+
+def make_unique_filename(output_file, dir_cache=None):
     """
     Ensure a filename is unique by appending a counter if the file already exists.
     
     Args:
         output_file: Path object for the desired output file
+        dir_cache: Optional dict mapping a directory Path to the set of normcased
+            names present or already claimed in it. The directory is listed once
+            on first use and the chosen name is added, so no per-name stat is needed.
         
     Returns:
         A Path object with a unique filename (counter appended if necessary)
     """
-    if not output_file.exists():
-        return output_file
-    
-    # File exists, need to append a counter
-    # Split filename and extension
-    stem = output_file.stem  # name without extension
-    suffix = output_file.suffix  # extension including the dot
     parent = output_file.parent
     
-    counter = 1
-    while True:
-        new_name = f"{stem} ({counter}){suffix}"
-        new_path = parent / new_name
-        if not new_path.exists():
-            return new_path
-        counter += 1
+    if dir_cache is None:
+        taken_names = None
+    else:
+        taken_names = dir_cache.get(parent)
+        if taken_names is None:
+            taken_names = {os.path.normcase(name) for name in os.listdir(parent)}
+            dir_cache[parent] = taken_names
+    
+    def is_taken(path):
+        if taken_names is None:
+            return path.exists()
+        return os.path.normcase(path.name) in taken_names
+    
+    unique_path = output_file
+    if is_taken(output_file):
+        # File exists, need to append a counter
+        # Split filename and extension
+        stem = output_file.stem  # name without extension
+        suffix = output_file.suffix  # extension including the dot
+        
+        counter = 1
+        while True:
+            new_name = f"{stem} ({counter}){suffix}"
+            unique_path = parent / new_name
+            if not is_taken(unique_path):
+                break
+            counter += 1
+    
+    if taken_names is not None:
+        taken_names.add(os.path.normcase(unique_path.name))
+    return unique_path
+
+
+def content_hexdigest(content, algorithm="md5"):
+    """
+    Hex digest used to name extracted files (naming only, not security).
+    
+    Args:
+        content: The file content (bytes or memoryview)
+        algorithm: One of NAME_HASH_ALGORITHMS; both produce 32 hex characters
+        
+    Returns:
+        The hex digest string
+    """
+    if algorithm == "md5":
+        return hashlib.md5(content, usedforsecurity=False).hexdigest()
+    if algorithm == "blake2b":
+        return hashlib.blake2b(content, digest_size=16).hexdigest()
+    raise ValueError(f"Unsupported hash algorithm: {algorithm}")
+
+
+def _write_extracted_file(output_file, content):
+    """Write one extracted embedded file to disk through a raw descriptor (no Python buffering)."""
+    fd = os.open(output_file, _WRITE_FLAGS, 0o666)
+    try:
+        remaining = memoryview(content)
+        while remaining:
+            written = os.write(fd, remaining)
+            remaining = remaining[written:]
+    finally:
+        os.close(fd)
+
+
+def resolve_amiibo_output_name(head_id, tail_id, use_pro_names=False, database_file=None):
+    """
+    Resolve the Series/Type subdirectory and sanitized filename for an amiibo ID.
+    
+    Args:
+        head_id: The amiibo head ID as a hex string
+        tail_id: The amiibo tail ID as a hex string
+        use_pro_names: If True, use "Pro" naming (no extension)
+        database_file: Optional path to a custom amiibo database JSON file
+        
+    Returns:
+        A tuple of (output_subdir, output_filename), or (None, None) if the
+        amiibo is not in the database
+    """
+    series_name, amiibo_type, amiibo_name, lookup_method = lookup_amiibo_data(head_id, tail_id, custom_database_path=database_file)
+    if not (series_name and amiibo_type and amiibo_name):
+        return None, None
+    
+    # Sanitize filenames
+    safe_series = sanitize_filename(series_name)
+    safe_type = sanitize_filename(amiibo_type)
+    safe_name = sanitize_filename(amiibo_name)
+    
+    # Create directory structure: Series/Type/
+    output_subdir = Path(safe_series) / safe_type
+    
+    # Use just the name as the filename
+    output_filename = safe_name
+    
+    if use_pro_names:
+        # Pro naming: no extension
+        pass
+    else:
+        # Add file extension based on file type
+        output_filename += ".bin"
+    
+    return output_subdir, output_filename
 
 
-def decode_fca(input_file, output_dir, use_pro_names=False, database_file=None):
+def decode_fca(input_file, output_dir, use_pro_names=False, database_file=None, hash_algorithm="md5"):
     """
     Extract all embedded files from an FCA archive.
     Files are named by their MD5 hash, or by amiibo series/name if available.
@@ -289,6 +548,8 @@ def decode_fca(input_file, output_dir, use_pro_names=False, database_file=None):
         output_dir: Path to output directory
         use_pro_names: If True, use "Pro" naming (no extensions) for amiibo files
         database_file: Optional path to a custom amiibo database JSON file
+        hash_algorithm: Hash used for fallback names, one of NAME_HASH_ALGORITHMS
+            ("blake2b" is faster than the default "md5" but gives different names)
     """
     input_path = Path(input_file)
     output_path = Path(output_dir)
@@ -296,39 +557,67 @@ def decode_fca(input_file, output_dir, use_pro_names=False, database_file=None):
     if not input_path.is_file():
         raise ValueError(f"Input file does not exist: {input_file}")
     
+    if hash_algorithm not in NAME_HASH_ALGORITHMS:
+        raise ValueError(f"Unsupported hash algorithm: {hash_algorithm}")
+    
     # Create output directory if it doesn't exist
     output_path.mkdir(parents=True, exist_ok=True)
     
+    # Map large archives read-only and parse records from the mapping; payload
+    # views are hashed and written straight from the page cache without copies.
+    # Small archives, and platforms or filesystems without mmap support, take a
+    # single read() instead (this also covers empty files, which cannot be mapped).
     with open(input_path, 'rb') as f:
+        data = None
+        if os.fstat(f.fileno()).st_size >= _MMAP_MIN_SIZE:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                pass
+        if data is None:
+            data = f.read()
+    
+    try:
+        data_size = len(data)
+        data_view = memoryview(data)
+        
         # Read and verify magic bytes
-        magic = f.read(3)
+        magic = data[0:3]
         if magic != b'FCA':
             raise ValueError(f"Invalid FCA file: magic bytes '{magic}' != 'FCA'")
         
         # Read version
-        version = struct.unpack('>B', f.read(1))[0]
+        if data_size < 4:
+            raise ValueError("Invalid FCA file: missing version byte")
+        version = data[3]
         print(f"FCA version: {version}")
         
         file_count = 0
+        offset = 4
+        
+        # Parsed records: (output_subdir, output_filename or None, content, header_size, type name)
+        records = []
+        dir_cache = {}
+        amiibo_names = {}
         
         # Read embedded files until EOF
         while True:
-            # Read total size (4 bytes, big-endian)
-            total_size_bytes = f.read(4)
-            if len(total_size_bytes) < 4:
+            # Read total size (4 bytes) and header size (2 bytes) in one unpack
+            if data_size - offset < 4:
                 # EOF reached
                 break
+            if data_size - offset < _RECORD_PREFIX.size:
+                raise ValueError(f"Unexpected EOF while reading header size for embedded file {file_count + 1}")
             
-            total_size = struct.unpack('>I', total_size_bytes)[0]
-            
-            # Read header size (2 bytes, big-endian)
-            header_size = struct.unpack('>H', f.read(2))[0]
+            total_size, header_size = _RECORD_PREFIX.unpack_from(data, offset)
+            offset += _RECORD_PREFIX.size
             
             # Read header bytes (if any)
             file_type_name = "Unknown"
             file_type = FILE_TYPE_UNKNOWN
             if header_size > 0:
-                header_bytes = f.read(header_size)
+                header_bytes = data[offset:offset + header_size]
+                offset += header_size
                 if len(header_bytes) < header_size:
                     raise ValueError(f"Unexpected EOF while reading header for embedded file {file_count + 1}")
                 
@@ -343,9 +632,12 @@ def decode_fca(input_file, output_dir, use_pro_names=False, database_file=None):
             
             # Calculate embedded file size
             embedded_size = total_size - 2 - header_size
+            if embedded_size < 0:
+                raise ValueError(f"Invalid total size for embedded file {file_count + 1}")
             
-            # Read embedded file content
-            content = f.read(embedded_size)
+            # Embedded file content is a zero-copy view into the archive mapping
+            content = data_view[offset:offset + embedded_size]
+            offset += embedded_size
             
             if len(content) < embedded_size:
                 raise ValueError(f"Unexpected EOF while reading embedded file {file_count + 1}")
@@ -359,53 +651,67 @@ def decode_fca(input_file, output_dir, use_pro_names=False, database_file=None):
             if file_type in (FILE_TYPE_AMIIBO_V2, FILE_TYPE_AMIIBO_V3):
                 head_id, tail_id = extract_amiibo_id(content)
                 if head_id and tail_id:
-                    series_name, amiibo_type, amiibo_name, lookup_method = lookup_amiibo_data(head_id, tail_id, custom_database_path=database_file)
-                    if series_name and amiibo_type and amiibo_name:
-                        # Sanitize filenames
-                        safe_series = sanitize_filename(series_name)
-                        safe_type = sanitize_filename(amiibo_type)
-                        safe_name = sanitize_filename(amiibo_name)
-                        
-                        # Create directory structure: Series/Type/
-                        output_subdir = Path(safe_series) / safe_type
-                        
-                        # Use just the name as the filename
-                        output_filename = safe_name
-                        
-                        if use_pro_names:
-                            # Pro naming: no extension
-                            pass
-                        else:
-                            # Add file extension based on file type
-                            output_filename += ".bin"
+                    # Archives often hold several dumps of the same amiibo; resolve each ID once
+                    amiibo_key = (head_id, tail_id)
+                    if amiibo_key not in amiibo_names:
+                        amiibo_names[amiibo_key] = resolve_amiibo_output_name(
+                            head_id, tail_id, use_pro_names=use_pro_names, database_file=database_file
+                        )
+                    output_subdir, output_filename = amiibo_names[amiibo_key]
             
-            # Fallback to MD5 hash if no amiibo name found
-            if output_filename is None:
-                md5_hash = hashlib.md5(content).hexdigest()
-                output_filename = md5_hash
-            
-            # Create output file path with subdirectories
-            if output_subdir is not None:
-                full_output_path = output_path / output_subdir
-                full_output_path.mkdir(parents=True, exist_ok=True)
-                output_file = full_output_path / output_filename
-            else:
-                output_file = output_path / output_filename
-            
-            # Handle duplicate filenames by appending a counter
-            output_file = make_unique_filename(output_file)
+            # Files without an amiibo name are named by MD5 once all records are parsed
+            records.append((output_subdir, output_filename, content, header_size, file_type_for_output))
+            file_count += 1
+        
+        # Hash fallback names and write files on a thread pool (hashlib releases the GIL
+        # for larger buffers); names are still claimed in archive order, so output is deterministic
+        with ThreadPoolExecutor() as pool:
+            hash_names = pool.map(partial(content_hexdigest, algorithm=hash_algorithm), [
+                content for _, output_filename, content, _, _ in records if output_filename is None
+            ])
             
-            # Write file
-            with open(output_file, 'wb') as out_file:
-                out_file.write(content)
+            write_futures = []
+            for index, (output_subdir, output_filename, content, header_size, file_type_for_output) in enumerate(records, 1):
+                # Fallback to content hash if no amiibo name found
+                if output_filename is None:
+                    output_filename = next(hash_names)
+                
+                # Create output file path with subdirectories
+                if output_subdir is not None:
+                    full_output_path = output_path / output_subdir
+                    full_output_path.mkdir(parents=True, exist_ok=True)
+                    output_file = full_output_path / output_filename
+                else:
+                    output_file = output_path / output_filename
+                
+                # Handle duplicate filenames by appending a counter
+                output_file = make_unique_filename(output_file, dir_cache=dir_cache)
+                
+                # Show relative path for better readability
+                relative_path = output_file.relative_to(output_path)
+                embedded_size = len(content)
+                if version == 1 and header_size == 2:
+                    message = f"Extracted file {index}: {relative_path} ({embedded_size} bytes, type: {file_type_for_output})"
+                else:
+                    message = f"Extracted file {index}: {relative_path} ({embedded_size} bytes)"
+                
+                # Queue file for writing; it is reported once the write has finished
+                write_futures.append((pool.submit(_write_extracted_file, output_file, content), message))
             
-            file_count += 1
-            # Show relative path for better readability
-            relative_path = output_file.relative_to(output_path)
-            if version == 1 and header_size == 2:
-                print(f"Extracted file {file_count}: {relative_path} ({embedded_size} bytes, type: {file_type_for_output})")
-            else:
-                print(f"Extracted file {file_count}: {relative_path} ({embedded_size} bytes)")
+            # Any write error is re-raised here
+            for future, message in write_futures:
+                future.result()
+                print(message)
+    finally:
+        # The mapping can only be closed once no views into it are left
+        records = content = data_view = None
+        if isinstance(data, mmap.mmap):
+            try:
+                data.close()
+            except BufferError:
+                # A propagating write error still references a view; the
+                # mapping is released when that exception is collected
+                pass
     
     print(f"\nExtracted {file_count} files to: {output_path}")
 
@@ -431,11 +737,17 @@ def main():
         action='store_true',
         help='Use Pro file names (no extensions) for amiibo files'
     )
+    parser.add_argument(
+        '--hash',
+        choices=NAME_HASH_ALGORITHMS,
+        default='md5',
+        help='Hash used to name files without an amiibo name (default: md5)'
+    )
     
     args = parser.parse_args()
     
     try:
-        decode_fca(args.input_file, args.output_dir, use_pro_names=args.pro_names)
+        decode_fca(args.input_file, args.output_dir, use_pro_names=args.pro_names, hash_algorithm=args.hash)
     except Exception as e:
         print(f"Error: {e}", file=os.sys.stderr)
         os.sys.exit(1)
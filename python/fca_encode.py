@@ -7,6 +7,7 @@ Usage:
 """
 
 import argparse
+import shutil
 import struct
 import os
 from pathlib import Path
@@ -19,15 +20,35 @@ from constants import (
     FILE_TYPE_LEGO_DIMENSIONS,
 )
 
+# Version 1 record header: total size, header size, file type, reserved (big-endian)
+RECORD_HEADER_V1 = struct.Struct('>IHBB')
 
-def detect_file_type(content):
-    """Auto-detect file type based on size and content."""
-    size = len(content)
+# Bytes read from the start of each input file for type detection
+# (the furthest signature check in detect_file_type ends at offset 144)
+DETECT_SNIFF_SIZE = 160
+
+# Chunk size for copying payloads into the archive
+COPY_CHUNK_SIZE = 1 << 20
+
+# Write buffer for the archive, so small records coalesce into few write() syscalls
+ARCHIVE_BUFFER_SIZE = 1 << 20
+
+
+def detect_file_type(content, size=None):
+    """
+    Auto-detect file type based on size and content.
+    
+    Args:
+        content: The file bytes, or at least its first DETECT_SNIFF_SIZE bytes
+        size: Total file size; defaults to len(content)
+    """
+    if size is None:
+        size = len(content)
 
     # Lego Dimensions detection
     # Signature observed across all tested Lego Dimensions BIN files.
     if size == 180:
-        if content[0] == 0x04 and content[7] == 0x80 and content[8:144] == (b'\x00' * 136):
+        if content[0] == 0x04 and content[7] == 0x80 and content.count(0, 8, 144) == 136:
             return FILE_TYPE_LEGO_DIMENSIONS
 
     # Disney Infinity detection
@@ -35,33 +56,106 @@ def detect_file_type(content):
     if size == 320:
         if (
             content[0] == 0x04
-            and content[7:11] == b'\x89\x44\x00\xC2'
-            and content[54:57] == b'\x17\x87\x8E'
+            and content.startswith(b'\x89\x44\x00\xC2', 7)
+            and content.startswith(b'\x17\x87\x8E', 54)
         ):
             return FILE_TYPE_DISNEY_INFINITY
 
     # Skylanders detection
     # Common signatures observed across 1024-byte and 2048-byte Skylanders BIN files.
     if size in (1024, 2048):
-        if content[5:8] == b'\x81\x01\x0F' and content[54:58] == b'\x0F\x0F\x0F\x69':
+        if content.startswith(b'\x81\x01\x0F', 5) and content.startswith(b'\x0F\x0F\x0F\x69', 54):
             return FILE_TYPE_SKYLANDER
     
     # Amiibo detection
     if size in (532, 540, 572):
         # Check for NTAG215 signature
         # Byte 0x00C-0x00F: Capability Container (CC)
-        cc = content[0x0C:0x10]
-        if cc == b'\xF1\x10\xFF\xEE':  # NTAG215 CC
+        if content.startswith(b'\xF1\x10\xFF\xEE', 0x0C):  # NTAG215 CC
             return FILE_TYPE_AMIIBO_V2
     
     elif size == 2048:
         # NTAG I2C Plus 2K (Kirby)
-        cc = content[0x0C:0x10]
-        if cc == b'\xF1\x10\xFF\xEE':  # Check if amiibo-like
+        if content.startswith(b'\xF1\x10\xFF\xEE', 0x0C):  # Check if amiibo-like
             return FILE_TYPE_AMIIBO_V3
     
     return FILE_TYPE_UNKNOWN
 
+def write_embedded_file(f, file_path):
+    """
+    Append one file to an open FCA archive as a version 1 record.
+    Only the first DETECT_SNIFF_SIZE bytes are read for type detection; the
+    rest of the payload is copied in chunks instead of being loaded whole.
+    
+    Args:
+        f: Archive file object opened for binary writing
+        file_path: Path to the file to embed
+    """
+    with open(file_path, 'rb') as src:
+        # Calculate sizes
+        header_size = 2  # Version 1 header: 2 bytes (file type + reserved)
+        embedded_size = os.fstat(src.fileno()).st_size
+        total_size = 2 + header_size + embedded_size  # 2 bytes for header_size field
+        
+        # Auto-detect file type from the leading bytes
+        head = src.read(DETECT_SNIFF_SIZE)
+        file_type = detect_file_type(head, size=embedded_size)
+        
+        # Write the record header in one call:
+        # total size (4 bytes, big-endian), header size (2 bytes, big-endian),
+        # then the version 1 header bytes
+        # Byte 0: File type (0=Unknown, 1=amiibo v2, 2=amiibo v3, 3=Skylander, 4=Disney Infinity, 5=Lego Dimensions)
+        # Byte 1: Reserved (must be 0x00)
+        f.write(RECORD_HEADER_V1.pack(total_size, header_size, file_type, 0x00))
+        
+        # Write embedded file content
+        payload_start = f.tell()
+        f.write(head)
+        shutil.copyfileobj(src, f, COPY_CHUNK_SIZE)
+        
+        # The size field is already written, so a file that changed size meanwhile is fatal
+        if f.tell() - payload_start != embedded_size:
+            raise ValueError(f"Input file changed size while archiving: {file_path}")
+
+
+def iter_input_files(top):
+    """
+    Yield an os.DirEntry for every non-hidden file below top.
+    Hidden files and directories (leading '.') are skipped, and symlinked
+    directories are listed but not followed, matching os.walk() defaults.
+    
+    Args:
+        top: Directory to scan
+    """
+    pending = [os.fspath(top)]
+    while pending:
+        try:
+            scanner = os.scandir(pending.pop())
+        except OSError:
+            continue
+        with scanner:
+            for entry in scanner:
+                if entry.name.startswith('.'):
+                    continue
+                # DirEntry caches its type from the directory listing, so no stat per file
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        pending.append(entry.path)
+                else:
+                    yield entry
+
+
+def archive_sort_key(path):
+    """
+    Sort key giving archive member order: path components compared in order,
+    as pathlib does, without building a Path per file or parsing it per comparison.
+    
+    Args:
+        path: Normalized file path string
+    """
+    return os.path.normcase(path).split(os.sep)
+
+
 def encode_fca(input_dirs, output_file, exclude_pattern=None):
     """
     Recursively concatenate all files from input_dirs into an FCA archive.
@@ -82,26 +176,18 @@ def encode_fca(input_dirs, output_file, exclude_pattern=None):
         input_path = Path(input_dir)
         if not input_path.is_dir():
             raise ValueError(f"Input path is not a directory: {input_dir}")
-        for root, dirs, filenames in os.walk(input_path):
-            # Don't descend into hidden directories
-            dirs[:] = [d for d in dirs if not d.startswith('.')]
-            for filename in filenames:
-                if filename.startswith('.'):
-                    continue
-                file_path = Path(root) / filename
-                if exclude_pattern is not None:
-                    try:
-                        rel = file_path.relative_to(input_path)
-                    except ValueError:
-                        rel = file_path
-                    if exclude_pattern in str(rel):
-                        continue
-                files.append(file_path)
+        top = str(input_path)
+        rel_start = len(os.path.join(top, ''))
+        for entry in iter_input_files(top):
+            file_path = entry.path
+            if exclude_pattern is not None and exclude_pattern in file_path[rel_start:]:
+                continue
+            files.append(file_path)
     
     # Sort files for consistent output
-    files.sort()
+    files.sort(key=archive_sort_key)
     
-    with open(output_path, 'wb') as f:
+    with open(output_path, 'wb', buffering=ARCHIVE_BUFFER_SIZE) as f:
         # Write global header
         # Magic bytes: "FCA"
         f.write(b'FCA')
@@ -110,31 +196,7 @@ def encode_fca(input_dirs, output_file, exclude_pattern=None):
         
         # Write each embedded file
         for file_path in files:
-            # Read file content
-            with open(file_path, 'rb') as file_content:
-                content = file_content.read()
-            
-            # Calculate sizes
-            header_size = 2  # Version 1 header: 2 bytes (file type + reserved)
-            embedded_size = len(content)
-            total_size = 2 + header_size + embedded_size  # 2 bytes for header_size field
-            
-            # Write total size (4 bytes, big-endian)
-            f.write(struct.pack('>I', total_size))
-            
-            # Write header size (2 bytes, big-endian)
-            f.write(struct.pack('>H', header_size))
-            
-            # Write header bytes (version 1 format)
-            # Byte 0: File type (0=Unknown, 1=amiibo v2, 2=amiibo v3, 3=Skylander, 4=Disney Infinity, 5=Lego Dimensions)
-            # Byte 1: Reserved (must be 0x00)
-    
-            # Auto-detect file type
-            file_type = detect_file_type(content)
-            f.write(struct.pack('>BB', file_type, 0x00))
-            
-            # Write embedded file content
-            f.write(content)
+            write_embedded_file(f, file_path)
     
     print(f"Created FCA archive: {output_path}")
     print(f"Embedded {len(files)} files")
@@ -26,12 +26,12 @@ from constants import (
     FILE_TYPE_DISNEY_INFINITY,
     FILE_TYPE_LEGO_DIMENSIONS,
 )
-from fca_encode import detect_file_type
-from fca_decode import decode_fca, FILE_TYPE_NAMES, get_file_type_name
+from fca_encode import ARCHIVE_BUFFER_SIZE, archive_sort_key, iter_input_files, write_embedded_file
+from fca_decode import decode_fca, FILE_TYPE_NAMES, NAME_HASH_ALGORITHMS, get_file_type_name
 
 
 def collect_input_files(input_files=None, input_dirs=None):
-    """Collect input files from explicit files and/or directories recursively."""
+    """Collect input file paths (as strings) from explicit files and/or directories recursively."""
     input_files = input_files or []
     input_dirs = input_dirs or []
 
@@ -45,23 +45,28 @@ def collect_input_files(input_files=None, input_dirs=None):
         resolved = str(path.resolve())
         if resolved not in seen_paths:
             seen_paths.add(resolved)
-            resolved_files.append(path)
+            resolved_files.append(str(path))
 
     for input_dir in input_dirs:
         input_path = Path(input_dir)
         if not input_path.is_dir():
             raise ValueError(f"Input path is not a directory: {input_dir}")
 
-        for root, dirs, filenames in os.walk(input_path):
-            dirs[:] = [d for d in dirs if not d.startswith('.')]
-            for filename in filenames:
-                if filename.startswith('.'):
-                    continue
-                file_path = Path(root) / filename
-                resolved = str(file_path.resolve())
-                if resolved not in seen_paths:
-                    seen_paths.add(resolved)
-                    resolved_files.append(file_path)
+        # Resolve the root once; walked paths only extend it, so their dedup key is
+        # built by prefix substitution instead of a resolve() (stat per component) per file.
+        # Symlinked files can point anywhere and are still resolved individually.
+        walk_top = str(input_path)
+        resolved_top = str(input_path.resolve())
+
+        for entry in iter_input_files(walk_top):
+            file_path = entry.path
+            if entry.is_symlink():
+                resolved = os.path.realpath(file_path)
+            else:
+                resolved = resolved_top + file_path[len(walk_top):]
+            if resolved not in seen_paths:
+                seen_paths.add(resolved)
+                resolved_files.append(file_path)
 
     if not resolved_files:
         raise ValueError("At least one input file is required")
@@ -74,29 +79,17 @@ def encode_fca_from_sources(output_file, input_files=None, input_dirs=None):
     resolved_files = collect_input_files(input_files=input_files, input_dirs=input_dirs)
 
     # Stable ordering for deterministic archives
-    resolved_files.sort()
+    resolved_files.sort(key=archive_sort_key)
 
     output_path = Path(output_file)
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
-    with open(output_path, "wb") as f:
+    with open(output_path, "wb", buffering=ARCHIVE_BUFFER_SIZE) as f:
         f.write(b"FCA")
         f.write(struct.pack(">B", 1))
 
         for file_path in resolved_files:
-            with open(file_path, "rb") as file_content:
-                content = file_content.read()
-
-            header_size = 2
-            embedded_size = len(content)
-            total_size = 2 + header_size + embedded_size
-
-            f.write(struct.pack(">I", total_size))
-            f.write(struct.pack(">H", header_size))
-
-            file_type = detect_file_type(content)
-            f.write(struct.pack(">BB", file_type, 0x00))
-            f.write(content)
+            write_embedded_file(f, file_path)
 
     print(f"Created FCA archive: {output_path}")
     print(f"Embedded {len(resolved_files)} files")
@@ -178,11 +171,19 @@ def run_gui():
     buttons_frame = ttk.Frame(encode_tab)
     buttons_frame.pack(fill=tk.X, padx=10, pady=8)
 
+    # Mirror of the listbox contents, so duplicate checks don't read the list back from Tk
+    listed_paths = set()
+
+    def add_to_list(paths):
+        new_paths = list(dict.fromkeys(p for p in map(str, paths) if p not in listed_paths))
+        if new_paths:
+            listed_paths.update(new_paths)
+            input_listbox.insert(tk.END, *new_paths)
+        return len(new_paths)
+
     def add_files():
         files = filedialog.askopenfilenames(title="Select input files")
-        for file_path in files:
-            if file_path not in input_listbox.get(0, tk.END):
-                input_listbox.insert(tk.END, file_path)
+        add_to_list(files)
         status_var.set(f"Added {len(files)} file(s)")
 
     def add_folder_recursive():
@@ -195,26 +196,20 @@ def run_gui():
             messagebox.showerror("Encode", f"Error: {e}")
             return
 
-        existing = set(input_listbox.get(0, tk.END))
-        added = 0
-        for file_path in files:
-            file_str = str(file_path)
-            if file_str not in existing:
-                input_listbox.insert(tk.END, file_str)
-                existing.add(file_str)
-                added += 1
-
+        added = add_to_list(files)
         status_var.set(f"Added {added} file(s) from folder")
 
     def remove_selected_files():
         selected = list(input_listbox.curselection())
         selected.reverse()
         for index in selected:
+            listed_paths.discard(input_listbox.get(index))
             input_listbox.delete(index)
         status_var.set("Removed selected file(s)")
 
     def clear_files():
         input_listbox.delete(0, tk.END)
+        listed_paths.clear()
         status_var.set("Cleared file list")
 
     ttk.Button(buttons_frame, text="Add files", command=add_files).pack(side=tk.LEFT, padx=(0, 6))
@@ -321,43 +316,20 @@ def run_gui():
             db_status_label.config(foreground="red")
     
     def download_database_gui():
-        """Download amiibo database from API and save locally."""
+        """Download or refresh the amiibo database in the script directory."""
+        from fca_decode import download_amiibo_database_to_script_dir
+        
         status_var.set("Downloading amiibo database...")
         root.update()
         
-        try:
-            import requests
-            db_path = Path(__file__).parent / "amiibo_database.json"
-            
-            print(f"Downloading amiibo database from amiiboapi.org...")
-            url = "https://amiiboapi.org/api/amiibo/"
-            response = requests.get(url, timeout=30)
-            
-            if response.status_code != 200:
-                status_var.set("Download failed")
-                messagebox.showerror("Database Download", f"API error: {response.status_code}")
-                return
-            
-            data = response.json()
-            amiibo_list = data.get("amiibo", [])
-            
-            if not amiibo_list:
-                status_var.set("Download failed")
-                messagebox.showerror("Database Download", "No amiibo data received")
-                return
-            
-            # Save to file
-            with open(db_path, 'w', encoding='utf-8') as f:
-                import json
-                json.dump(data, f, indent=2, ensure_ascii=False)
-            
-            status_var.set(f"✓ Downloaded {len(amiibo_list)} amiibo entries")
-            messagebox.showinfo("Database Download", f"Successfully downloaded {len(amiibo_list)} amiibo entries\nSaved to: {db_path}")
-            update_db_status()
-        
-        except Exception as e:
+        db_path = Path(__file__).parent / "amiibo_database.json"
+        if download_amiibo_database_to_script_dir(force=True):
+            status_var.set("✓ Amiibo database is up to date")
+            messagebox.showinfo("Database Download", f"Amiibo database is up to date\nSaved to: {db_path}")
+        else:
             status_var.set("Download failed")
-            messagebox.showerror("Database Download", f"Error: {e}")
+            messagebox.showerror("Database Download", "Could not download the amiibo database (see console output for details)")
+        update_db_status()
     
     db_status_var = tk.StringVar()
     db_status_label = ttk.Label(db_status_frame, textvariable=db_status_var, anchor="w")
@@ -455,12 +427,18 @@ def main():
         metavar="<file>",
         help="Path to custom amiibo database JSON file",
     )
+    decode_parser.add_argument(
+        "--hash",
+        choices=NAME_HASH_ALGORITHMS,
+        default="md5",
+        help="Hash used to name files without an amiibo name (default: md5)",
+    )
 
     download_parser = subparsers.add_parser("download-database", help="Download amiibo database from amiiboapi.org")
     download_parser.add_argument(
         "--force",
         action="store_true",
-        help="Force re-download even if database already exists",
+        help="Refresh an existing database (nothing is transferred if the server copy is unchanged)",
     )
 
     args = parser.parse_args()
@@ -477,7 +455,7 @@ def main():
                 input_dirs=args.input_dirs,
             )
         elif args.command == "decode":
-            decode_fca(args.input_file, args.output_dir, use_pro_names=args.pro_names, database_file=args.database if hasattr(args, 'database') else None)
+            decode_fca(args.input_file, args.output_dir, use_pro_names=args.pro_names, database_file=args.database if hasattr(args, 'database') else None, hash_algorithm=args.hash)
         elif args.command == "download-database":
             from fca_decode import download_amiibo_database_to_script_dir
             success = download_amiibo_database_to_script_dir(force=args.force if hasattr(args, 'force') else False)
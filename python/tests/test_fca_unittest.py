@@ -7,6 +7,7 @@ Run with: python3 -m unittest tests.test_fca_unittest
 import unittest
 import struct
 import hashlib
+import json
 import tempfile
 import shutil
 from pathlib import Path
@@ -15,144 +16,184 @@ import os
 
 # Add parent directory to path to import fca_encode and fca_decode
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from fca_encode import encode_fca, detect_file_type
-from fca_decode import decode_fca
+from fca_encode import encode_fca, detect_file_type, DETECT_SNIFF_SIZE
+import fca_decode
+from fca_decode import decode_fca, load_amiibo_database, lookup_amiibo_data, make_unique_filename
 from fca_tool import encode_fca_from_sources
 from constants import (
+    FILE_TYPE_UNKNOWN,
     FILE_TYPE_AMIIBO_V2,
     FILE_TYPE_AMIIBO_V3,
 )
 
+# Precompiled big-endian archive layouts: global header (magic + version) and
+# record prefix (total size + header size)
+_ARCHIVE_HEADER = struct.Struct('>3sB')
+_RECORD_PREFIX = struct.Struct('>IH')
+# Global header followed by the first record prefix, for single-record archives
+_ARCHIVE_HEAD = struct.Struct('>3sBIH')
+
+
+def _iter_records(data):
+    """Yield (header bytes, content) for each embedded file in an archive buffer."""
+    offset = _ARCHIVE_HEADER.size
+    while len(data) - offset >= 4:
+        total_size, header_size = _RECORD_PREFIX.unpack_from(data, offset)
+        header_start = offset + _RECORD_PREFIX.size
+        offset += 4 + total_size
+        yield data[header_start:header_start + header_size], data[header_start + header_size:offset]
+    # Records must end exactly at EOF
+    assert offset == len(data)
+
+
+def _expected_archive(*records):
+    """Exact version 1 archive bytes for the given (file type, content) records."""
+    parts = [_ARCHIVE_HEADER.pack(b'FCA', 1)]
+    for file_type, content in records:
+        parts.append(_RECORD_PREFIX.pack(2 + 2 + len(content), 2))
+        parts.append(bytes((file_type, 0x00)))
+        parts.append(content)
+    return b''.join(parts)
+
+
+def _walk_files(root):
+    """Yield a DirEntry for every file below root, using scandir's cached entry types."""
+    pending = [os.fspath(root)]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file():
+                    yield entry
+
+
+def _stage(src, dst):
+    """Stage a read-only test input by hard link, copying when linking is not possible."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy(src, dst)
+
+
+def _md5_path(path):
+    """MD5 hex digest of a file, hashed by hashlib without reading it into Python first."""
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'md5').hexdigest()
+
+
+# Scratch directory for the whole module: each test's temp_dir is created inside
+# it, and all of it is removed once in tearDownModule rather than per test.
+# Also built once for the module: an FCA archive of the whole test data directory
+# and its decoded output, an archive of file1.txt alone plus its decoded output, and the MD5 of each
+# non-hidden test data file mapped to its path
+_module_dir = None
+ENCODED_TEST_DATA = None
+DECODED_TEST_DATA = None
+SINGLE_FILE_FCA = None
+SINGLE_FILE_OUTPUT = None
+TEST_DATA_MD5S = None
+
+
+def setUpModule():
+    global _module_dir, ENCODED_TEST_DATA, DECODED_TEST_DATA, SINGLE_FILE_FCA, SINGLE_FILE_OUTPUT, TEST_DATA_MD5S
+    test_data_dir = Path(__file__).parent / 'test_data'
+    _module_dir = tempfile.mkdtemp()
+    ENCODED_TEST_DATA = Path(_module_dir) / 'test_data.fca'
+    encode_fca([str(test_data_dir)], str(ENCODED_TEST_DATA))
+    DECODED_TEST_DATA = Path(_module_dir) / 'test_data_output'
+    decode_fca(str(ENCODED_TEST_DATA), str(DECODED_TEST_DATA))
+    
+    single_file_dir = Path(_module_dir) / 'single_file'
+    single_file_dir.mkdir()
+    _stage(test_data_dir / 'file1.txt', single_file_dir / 'file1.txt')
+    SINGLE_FILE_FCA = Path(_module_dir) / 'single_file.fca'
+    encode_fca([str(single_file_dir)], str(SINGLE_FILE_FCA))
+    SINGLE_FILE_OUTPUT = Path(_module_dir) / 'single_file_output'
+    decode_fca(str(SINGLE_FILE_FCA), str(SINGLE_FILE_OUTPUT))
+    
+    TEST_DATA_MD5S = {
+        _md5_path(entry.path): entry.path
+        for entry in _walk_files(test_data_dir)
+        if not entry.name.startswith('.')
+    }
+
+
+def tearDownModule():
+    shutil.rmtree(_module_dir)
+
 
 class TestFCAEncode(unittest.TestCase):
     """Tests for FCA encoding."""
     
     def setUp(self):
         """Set up test fixtures."""
-        self.temp_dir = tempfile.mkdtemp()
+        self.temp_dir = tempfile.mkdtemp(dir=_module_dir)
         self.test_data_dir = Path(__file__).parent / 'test_data'
     
-    def tearDown(self):
-        """Clean up test fixtures."""
-        shutil.rmtree(self.temp_dir)
-    
     def test_encode_single_file(self):
-        """Test encoding a single file."""
-        # Create a temp directory with a single file
-        single_file_dir = Path(self.temp_dir) / 'single_file'
-        single_file_dir.mkdir()
-        shutil.copy(self.test_data_dir / 'file1.txt', single_file_dir / 'file1.txt')
-        
-        output_file = Path(self.temp_dir) / 'output.fca'
-        encode_fca([str(single_file_dir)], str(output_file))
-        
-        self.assertTrue(output_file.exists())
-        
-        # Verify file format
-        with open(output_file, 'rb') as f:
-            # Check magic bytes
-            magic = f.read(3)
-            self.assertEqual(magic, b'FCA')
-            
-            # Check version
-            version = struct.unpack('>B', f.read(1))[0]
-            self.assertEqual(version, 1)
-            
-            # Read embedded file entry
-            total_size = struct.unpack('>I', f.read(4))[0]
-            header_size = struct.unpack('>H', f.read(2))[0]
-            self.assertEqual(header_size, 2)  # Version 1 header is 2 bytes
-            
-            # Read header bytes
-            header_bytes = f.read(header_size)
-            self.assertEqual(len(header_bytes), 2)
-            self.assertEqual(header_bytes[0], 0x00)  # File type (currently 0)
-            self.assertEqual(header_bytes[1], 0x00)  # Reserved
-            
-            # Read content
-            content = f.read(total_size - 2 - header_size)
-            # Read the actual file to get expected content
-            with open(self.test_data_dir / 'file1.txt', 'rb') as orig_file:
-                expected_content = orig_file.read()
-            self.assertEqual(content, expected_content)
-            
-            # Verify total size calculation
-            self.assertEqual(total_size, 2 + header_size + len(expected_content))
+        """Test that encoding a single file (including an empty one) gives one well-formed record."""
+        for name in ('file1.txt', 'empty.txt', 'file2.bin'):
+            with self.subTest(name=name):
+                input_dir = Path(self.temp_dir) / name / 'input'
+                input_dir.mkdir(parents=True)
+                _stage(self.test_data_dir / name, input_dir / name)
+                expected_content = (self.test_data_dir / name).read_bytes()
+                
+                output_file = Path(self.temp_dir) / name / 'output.fca'
+                encode_fca([str(input_dir)], str(output_file))
+                
+                self.assertTrue(output_file.exists())
+                data = output_file.read_bytes()
+                
+                # Global header (3 bytes magic + 1 byte version), then the embedded file's
+                # big-endian total size and header size, in one unpack
+                magic, version, total_size, header_size = _ARCHIVE_HEAD.unpack_from(data, 0)
+                self.assertEqual(magic, b'FCA')
+                self.assertEqual(version, 1)
+                self.assertEqual(header_size, 2)  # Version 1 header is 2 bytes
+                offset = _ARCHIVE_HEAD.size
+                
+                # Read header bytes
+                header_bytes = data[offset:offset + header_size]
+                self.assertEqual(len(header_bytes), 2)
+                self.assertEqual(header_bytes[0], 0x00)  # File type (unknown for these inputs)
+                self.assertEqual(header_bytes[1], 0x00)  # Reserved
+                offset += header_size
+                
+                # Total size covers the header_size field, header bytes and content
+                # (an empty file gives total_size = 2 + 2 = 4)
+                self.assertEqual(total_size, 2 + header_size + len(expected_content))
+                content = data[offset:offset + len(expected_content)]
+                self.assertEqual(content, expected_content)
+                
+                # Should be at EOF
+                self.assertEqual(offset + len(expected_content), len(data))
     
     def test_encode_multiple_files(self):
         """Test encoding multiple files from a directory."""
-        output_file = Path(self.temp_dir) / 'output.fca'
-        encode_fca([str(self.test_data_dir)], str(output_file))
+        output_file = ENCODED_TEST_DATA
         
         self.assertTrue(output_file.exists())
         
         # Count files in test_data directory (recursively)
-        file_count = sum(1 for _ in self.test_data_dir.rglob('*') if _.is_file() and not _.name.startswith('.'))
+        file_count = sum(1 for entry in _walk_files(self.test_data_dir) if not entry.name.startswith('.'))
         
         # Verify file format and count embedded files
-        with open(output_file, 'rb') as f:
-            # Check magic bytes
-            magic = f.read(3)
-            self.assertEqual(magic, b'FCA')
-            
-            # Check version
-            version = struct.unpack('>B', f.read(1))[0]
-            self.assertEqual(version, 1)
-            
-            # Count embedded files
-            embedded_count = 0
-            while True:
-                total_size_bytes = f.read(4)
-                if len(total_size_bytes) < 4:
-                    break
-                
-                total_size = struct.unpack('>I', total_size_bytes)[0]
-                header_size = struct.unpack('>H', f.read(2))[0]
-                self.assertEqual(header_size, 2)  # Version 1 header is 2 bytes
-                
-                # Read header bytes
-                f.read(header_size)
-                
-                embedded_size = total_size - 2 - header_size
-                f.read(embedded_size)
-                embedded_count += 1
-            
-            self.assertEqual(embedded_count, file_count)
-    
-    def test_encode_empty_file(self):
-        """Test encoding an empty file."""
-        # Create a temp directory with an empty file
-        empty_file_dir = Path(self.temp_dir) / 'empty_file'
-        empty_file_dir.mkdir()
-        shutil.copy(self.test_data_dir / 'empty.txt', empty_file_dir / 'empty.txt')
+        data = output_file.read_bytes()
         
-        output_file = Path(self.temp_dir) / 'output.fca'
-        encode_fca([str(empty_file_dir)], str(output_file))
+        # Check magic bytes and version
+        magic, version = _ARCHIVE_HEADER.unpack_from(data, 0)
+        self.assertEqual(magic, b'FCA')
+        self.assertEqual(version, 1)
         
-        self.assertTrue(output_file.exists())
+        # Count embedded files
+        embedded_count = 0
+        for header_bytes, _ in _iter_records(data):
+            self.assertEqual(len(header_bytes), 2)  # Version 1 header is 2 bytes
+            embedded_count += 1
         
-        with open(output_file, 'rb') as f:
-            magic = f.read(3)
-            self.assertEqual(magic, b'FCA')
-            
-            version = struct.unpack('>B', f.read(1))[0]
-            self.assertEqual(version, 1)
-            
-            # Read embedded file entry
-            total_size = struct.unpack('>I', f.read(4))[0]
-            header_size = struct.unpack('>H', f.read(2))[0]
-            self.assertEqual(header_size, 2)  # Version 1 header is 2 bytes
-            
-            # Read header bytes
-            header_bytes = f.read(header_size)
-            self.assertEqual(len(header_bytes), 2)
-            
-            # Empty file should have total_size = 2 (header_size field) + 2 (header bytes) = 4
-            self.assertEqual(total_size, 4)
-            
-            # Should be at EOF
-            remaining = f.read(1)
-            self.assertEqual(len(remaining), 0)
+        self.assertEqual(embedded_count, file_count)
     
     def test_encode_invalid_input(self):
         """Test encoding with invalid input directory."""
@@ -166,36 +207,16 @@ class TestFCAEncode(unittest.TestCase):
         src_dir = Path(self.temp_dir) / 'src'
         src_dir.mkdir()
         (src_dir / 'subdir').mkdir()
-        shutil.copy(self.test_data_dir / 'file1.txt', src_dir / 'top.txt')
-        shutil.copy(self.test_data_dir / 'file2.bin', src_dir / 'subdir' / 'nested.bin')
+        _stage(self.test_data_dir / 'file1.txt', src_dir / 'top.txt')
+        _stage(self.test_data_dir / 'file2.bin', src_dir / 'subdir' / 'nested.bin')
 
         output_file = Path(self.temp_dir) / 'output.fca'
         encode_fca([str(src_dir)], str(output_file), exclude_pattern='subdir')
 
         self.assertTrue(output_file.exists())
-        with open(output_file, 'rb') as f:
-            f.read(4)  # magic + version
-            count = 0
-            while True:
-                total_size_bytes = f.read(4)
-                if len(total_size_bytes) < 4:
-                    break
-                total_size = struct.unpack('>I', total_size_bytes)[0]
-                header_size = struct.unpack('>H', f.read(2))[0]
-                f.read(header_size)
-                embedded_size = total_size - 2 - header_size
-                f.read(embedded_size)
-                count += 1
-        self.assertEqual(count, 1)
-        with open(output_file, 'rb') as f:
-            f.read(4)
-            total_size = struct.unpack('>I', f.read(4))[0]
-            header_size = struct.unpack('>H', f.read(2))[0]
-            f.read(header_size)
-            content = f.read(total_size - 2 - header_size)
-        with open(self.test_data_dir / 'file1.txt', 'rb') as f:
-            expected = f.read()
-        self.assertEqual(content, expected)
+        # Exactly one embedded file: top.txt (a file1.txt copy); subdir/nested.bin excluded
+        expected = _expected_archive((0x00, (self.test_data_dir / 'file1.txt').read_bytes()))
+        self.assertEqual(output_file.read_bytes(), expected)
 
 
 class TestFCADecode(unittest.TestCase):
@@ -203,27 +224,12 @@ class TestFCADecode(unittest.TestCase):
     
     def setUp(self):
         """Set up test fixtures."""
-        self.temp_dir = tempfile.mkdtemp()
+        self.temp_dir = tempfile.mkdtemp(dir=_module_dir)
         self.test_data_dir = Path(__file__).parent / 'test_data'
     
-    def tearDown(self):
-        """Clean up test fixtures."""
-        shutil.rmtree(self.temp_dir)
-    
     def test_decode_single_file(self):
         """Test decoding a single file archive."""
-        # Create a temp directory with a single file
-        single_file_dir = Path(self.temp_dir) / 'single_file'
-        single_file_dir.mkdir()
-        shutil.copy(self.test_data_dir / 'file1.txt', single_file_dir / 'file1.txt')
-        
-        # Create FCA file
-        fca_file = Path(self.temp_dir) / 'test.fca'
-        encode_fca([str(single_file_dir)], str(fca_file))
-        
-        # Decode it
-        output_dir = Path(self.temp_dir) / 'output'
-        decode_fca(str(fca_file), str(output_dir))
+        output_dir = SINGLE_FILE_OUTPUT
         
         # Verify output
         self.assertTrue(output_dir.is_dir())
@@ -235,39 +241,21 @@ class TestFCADecode(unittest.TestCase):
         extracted_file = output_dir / expected_md5
         self.assertTrue(extracted_file.exists())
         
-        with open(extracted_file, 'rb') as f:
-            self.assertEqual(f.read(), expected_content)
+        self.assertEqual(extracted_file.read_bytes(), expected_content)
     
     def test_decode_multiple_files(self):
         """Test decoding multiple files."""
-        # Create FCA file
-        fca_file = Path(self.temp_dir) / 'test.fca'
-        encode_fca([str(self.test_data_dir)], str(fca_file))
-        
-        # Decode it
-        output_dir = Path(self.temp_dir) / 'output'
-        decode_fca(str(fca_file), str(output_dir))
-        
-        # Count files in test_data
-        test_files = [f for f in self.test_data_dir.rglob('*') if f.is_file() and not f.name.startswith('.')]
-        
-        # Verify all files were extracted
-        extracted_files = list(output_dir.iterdir())
-        self.assertEqual(len(extracted_files), len(test_files))
+        output_dir = DECODED_TEST_DATA
         
-        # Verify MD5 hashes match
-        for test_file in test_files:
-            with open(test_file, 'rb') as f:
-                content = f.read()
-            expected_md5 = hashlib.md5(content).hexdigest()
-            self.assertTrue((output_dir / expected_md5).exists())
+        # Verify every test data file was extracted under its MD5, and nothing else
+        self.assertEqual(set(os.listdir(output_dir)), set(TEST_DATA_MD5S))
     
     def test_decode_empty_file(self):
         """Test decoding an archive with an empty file."""
         # Create a temp directory with an empty file
         empty_file_dir = Path(self.temp_dir) / 'empty_file'
         empty_file_dir.mkdir()
-        shutil.copy(self.test_data_dir / 'empty.txt', empty_file_dir / 'empty.txt')
+        _stage(self.test_data_dir / 'empty.txt', empty_file_dir / 'empty.txt')
         
         # Create FCA file with empty file
         fca_file = Path(self.temp_dir) / 'test.fca'
@@ -282,21 +270,88 @@ class TestFCADecode(unittest.TestCase):
         extracted_file = output_dir / expected_md5
         self.assertTrue(extracted_file.exists())
         
-        with open(extracted_file, 'rb') as f:
-            self.assertEqual(f.read(), b'')
+        self.assertEqual(extracted_file.read_bytes(), b'')
+    
+    def test_decode_duplicate_contents(self):
+        """Test that identical embedded files get distinct counter-suffixed names."""
+        dup_dir = Path(self.temp_dir) / 'duplicates'
+        dup_dir.mkdir()
+        _stage(self.test_data_dir / 'file1.txt', dup_dir / 'a.txt')
+        _stage(self.test_data_dir / 'file1.txt', dup_dir / 'b.txt')
+        
+        fca_file = Path(self.temp_dir) / 'test.fca'
+        encode_fca([str(dup_dir)], str(fca_file))
+        
+        output_dir = Path(self.temp_dir) / 'output'
+        decode_fca(str(fca_file), str(output_dir))
+        
+        expected_md5 = hashlib.md5(b'Hello, World!\nThis is a test file.\n').hexdigest()
+        self.assertEqual(
+            sorted(os.listdir(output_dir)),
+            [expected_md5, f"{expected_md5} (1)"],
+        )
+        
+        # Decoding again into the same directory must not overwrite earlier output
+        decode_fca(str(fca_file), str(output_dir))
+        self.assertEqual(len(os.listdir(output_dir)), 4)
+    
+    def test_unique_filename_case(self):
+        """Names that differ only in case collide only where the platform folds case."""
+        output_dir = Path(self.temp_dir)
+        (output_dir / 'A.bin').write_bytes(b'')
+        
+        unique_path = make_unique_filename(output_dir / 'a.bin', dir_cache={})
+        if os.path.normcase('A.bin') == 'A.bin':
+            self.assertEqual(unique_path.name, 'a.bin')
+        else:
+            self.assertEqual(unique_path.name, 'a (1).bin')
+    
+    @unittest.skipIf(sys.platform == 'win32', "POSIX permission bits")
+    def test_decode_file_mode_follows_umask(self):
+        """Extracted files get 0o666 masked by the umask, as open(..., 'wb') would give."""
+        output_dir = Path(self.temp_dir) / 'output'
+        old_umask = os.umask(0o002)
+        try:
+            decode_fca(str(SINGLE_FILE_FCA), str(output_dir))
+        finally:
+            os.umask(old_umask)
+        
+        extracted_file = output_dir / hashlib.md5(b'Hello, World!\nThis is a test file.\n').hexdigest()
+        self.assertEqual(extracted_file.stat().st_mode & 0o777, 0o664)
+    
+    def test_decode_blake2b_names(self):
+        """Test that the blake2b option names files by a 16-byte BLAKE2b digest."""
+        output_dir = Path(self.temp_dir) / 'output'
+        decode_fca(str(SINGLE_FILE_FCA), str(output_dir), hash_algorithm='blake2b')
+        
+        expected_content = b'Hello, World!\nThis is a test file.\n'
+        expected_name = hashlib.blake2b(expected_content, digest_size=16).hexdigest()
+        self.assertEqual(os.listdir(output_dir), [expected_name])
     
     def test_decode_invalid_magic(self):
         """Test decoding with invalid magic bytes."""
         invalid_file = Path(self.temp_dir) / 'invalid.fca'
-        with open(invalid_file, 'wb') as f:
-            f.write(b'XXX')  # Invalid magic
-            f.write(struct.pack('>B', 1))
+        invalid_file.write_bytes(_ARCHIVE_HEADER.pack(b'XXX', 1))  # Invalid magic
         
         output_dir = Path(self.temp_dir) / 'output'
         
         with self.assertRaises(ValueError):
             decode_fca(str(invalid_file), str(output_dir))
     
+    def test_decode_truncated_file(self):
+        """Test decoding an archive whose last embedded file is cut short."""
+        truncated_file = Path(self.temp_dir) / 'truncated.fca'
+        truncated_file.write_bytes(
+            _ARCHIVE_HEAD.pack(b'FCA', 1, 2 + 2 + 10, 2)
+            + b'\x00\x00'
+            + b'short'  # 5 of 10 bytes
+        )
+        
+        output_dir = Path(self.temp_dir) / 'output'
+        
+        with self.assertRaises(ValueError):
+            decode_fca(str(truncated_file), str(output_dir))
+    
     def test_decode_nonexistent_file(self):
         """Test decoding a nonexistent file."""
         output_dir = Path(self.temp_dir) / 'output'
@@ -305,73 +360,125 @@ class TestFCADecode(unittest.TestCase):
             decode_fca('/nonexistent/file.fca', str(output_dir))
 
 
-class TestFCARoundTrip(unittest.TestCase):
-    """Tests for round-trip encoding and decoding."""
+class TestAmiiboDatabase(unittest.TestCase):
+    """Tests for amiibo database loading."""
     
     def setUp(self):
-        """Set up test fixtures."""
-        self.temp_dir = tempfile.mkdtemp()
-        self.test_data_dir = Path(__file__).parent / 'test_data'
+        self.temp_dir = tempfile.mkdtemp(dir=_module_dir)
     
-    def tearDown(self):
-        """Clean up test fixtures."""
-        shutil.rmtree(self.temp_dir)
+    def test_custom_database_cached_until_modified(self):
+        """A custom database is parsed once and reloaded only after it changes."""
+        db_file = Path(self.temp_dir) / 'db.json'
+        db_file.write_text('{"amiibo": [{"name": "First"}]}', encoding='utf-8')
+        
+        first = load_amiibo_database(custom_database_path=str(db_file))
+        second = load_amiibo_database(custom_database_path=str(db_file))
+        self.assertIs(first, second)
+        
+        db_file.write_text('{"amiibo": [{"name": "Second"}]}', encoding='utf-8')
+        stat = db_file.stat()
+        os.utime(db_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        
+        reloaded = load_amiibo_database(custom_database_path=str(db_file))
+        self.assertEqual(reloaded["amiibo"][0]["name"], "Second")
     
-    def test_round_trip_single_file(self):
-        """Test encoding and then decoding a single file."""
-        # Create a temp directory with a single file
-        single_file_dir = Path(self.temp_dir) / 'single_file'
-        single_file_dir.mkdir()
-        shutil.copy(self.test_data_dir / 'file1.txt', single_file_dir / 'file1.txt')
+    def test_decode_names_amiibo_from_database(self):
+        """Repeated dumps of one amiibo are named from the database under Series/Type."""
+        test_data_dir = Path(__file__).parent / 'test_data'
+        amiibo_dir = Path(self.temp_dir) / 'amiibo'
+        amiibo_dir.mkdir()
+        _stage(test_data_dir / 'test-amiibo-v2.bin', amiibo_dir / 'a.bin')
+        _stage(test_data_dir / 'test-amiibo-v2.bin', amiibo_dir / 'b.bin')
+        db_file = Path(self.temp_dir) / 'db.json'
+        db_file.write_text(json.dumps({"amiibo": [
+            {"head": "01000000", "tail": "034f0902", "amiiboSeries": "Series A", "type": "Figure", "name": "Exact"},
+        ]}), encoding='utf-8')
         
-        # Encode
         fca_file = Path(self.temp_dir) / 'test.fca'
-        encode_fca([str(single_file_dir)], str(fca_file))
-        
-        # Decode
+        encode_fca([str(amiibo_dir)], str(fca_file))
         output_dir = Path(self.temp_dir) / 'output'
-        decode_fca(str(fca_file), str(output_dir))
+        decode_fca(str(fca_file), str(output_dir), database_file=str(db_file))
         
-        # Verify content matches
-        original_content = b'Hello, World!\nThis is a test file.\n'
-        expected_md5 = hashlib.md5(original_content).hexdigest()
+        extracted = sorted(os.listdir(output_dir / 'Series A' / 'Figure'))
+        self.assertEqual(extracted, ['Exact (1).bin', 'Exact.bin'])
+    
+    def test_lookup_uses_head_tail_then_tail(self):
+        """Lookup prefers head+tail matches, falls back to tail, and keeps the first entry."""
+        db_file = Path(self.temp_dir) / 'db.json'
+        db_file.write_text(json.dumps({"amiibo": [
+            {"head": "01000000", "tail": "034f0902", "amiiboSeries": "Series A", "type": "Figure", "name": "Exact"},
+            {"head": "01000000", "tail": "034f0902", "amiiboSeries": "Series A", "type": "Figure", "name": "Duplicate"},
+            {"head": "02000000", "tail": "00000003", "amiiboSeries": "Series B", "type": "Card", "name": "Tail Only"},
+        ]}), encoding='utf-8')
+        db_path = str(db_file)
+        
+        self.assertEqual(
+            lookup_amiibo_data("01000000", "034f0902", custom_database_path=db_path),
+            ("Series A", "Figure", "Exact", "database_head+tail"),
+        )
+        self.assertEqual(
+            lookup_amiibo_data("ffffffff", "00000003", custom_database_path=db_path),
+            ("Series B", "Card", "Tail Only", "database_tail"),
+        )
+        self.assertEqual(
+            lookup_amiibo_data("ffffffff", "ffffffff", custom_database_path=db_path),
+            (None, None, None, "not_found"),
+        )
+        
+        # The lookup index is kept outside the loaded data, which stays plain JSON
+        database = load_amiibo_database(custom_database_path=db_path)
+        self.assertEqual(list(database), ["amiibo"])
+        self.assertEqual(json.loads(json.dumps(database)), json.loads(db_file.read_text(encoding='utf-8')))
+
+
+class TestFCARoundTrip(unittest.TestCase):
+    """Tests for round-trip encoding and decoding."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp(dir=_module_dir)
+        self.test_data_dir = Path(__file__).parent / 'test_data'
+    
+    def test_round_trip_single_file(self):
+        """Test that re-encoding the decoded output reproduces the archive."""
+        reencoded_file = Path(self.temp_dir) / 'second.fca'
+        encode_fca([str(SINGLE_FILE_OUTPUT)], str(reencoded_file))
         
-        extracted_file = output_dir / expected_md5
-        with open(extracted_file, 'rb') as f:
-            self.assertEqual(f.read(), original_content)
+        self.assertEqual(reencoded_file.read_bytes(), SINGLE_FILE_FCA.read_bytes())
     
     def test_round_trip_multiple_files(self):
         """Test encoding and decoding multiple files."""
-        # Encode
-        fca_file = Path(self.temp_dir) / 'test.fca'
-        encode_fca([str(self.test_data_dir)], str(fca_file))
+        output_dir = DECODED_TEST_DATA
         
-        # Decode
-        output_dir = Path(self.temp_dir) / 'output'
-        decode_fca(str(fca_file), str(output_dir))
+        # Verify all files match (one directory listing instead of a stat per file)
+        present = set(os.listdir(output_dir))
+        for expected_md5, test_file in TEST_DATA_MD5S.items():
+            self.assertIn(expected_md5, present, f"File {test_file} not found in output")
+            self.assertEqual(_md5_path(output_dir / expected_md5), expected_md5)
+    
+    def test_round_trip_mmap(self):
+        """Round trip through the memory-mapped path that large archives take."""
+        fca_file = ENCODED_TEST_DATA
         
-        # Verify all files match
-        for test_file in self.test_data_dir.rglob('*'):
-            if not test_file.is_file() or test_file.name.startswith('.'):
-                continue
-            
-            with open(test_file, 'rb') as f:
-                original_content = f.read()
-            
-            expected_md5 = hashlib.md5(original_content).hexdigest()
-            extracted_file = output_dir / expected_md5
-            
-            self.assertTrue(extracted_file.exists(), f"File {test_file} not found in output")
-            
-            with open(extracted_file, 'rb') as f:
-                self.assertEqual(f.read(), original_content)
+        output_dir = Path(self.temp_dir) / 'output'
+        old_min_size = fca_decode._MMAP_MIN_SIZE
+        fca_decode._MMAP_MIN_SIZE = 0
+        try:
+            decode_fca(str(fca_file), str(output_dir))
+        finally:
+            fca_decode._MMAP_MIN_SIZE = old_min_size
+        
+        # Names are hashed from the mapped payloads, and contents written from them
+        self.assertEqual(len(os.listdir(output_dir)), 7)
+        for extracted_file in output_dir.iterdir():
+            self.assertEqual(_md5_path(extracted_file), extracted_file.name)
     
     def test_round_trip_binary_files(self):
         """Test round-trip with binary files."""
         # Create a temp directory with a binary file
         binary_file_dir = Path(self.temp_dir) / 'binary_file'
         binary_file_dir.mkdir()
-        shutil.copy(self.test_data_dir / 'file2.bin', binary_file_dir / 'file2.bin')
+        _stage(self.test_data_dir / 'file2.bin', binary_file_dir / 'file2.bin')
         
         # Encode binary file
         fca_file = Path(self.temp_dir) / 'test.fca'
@@ -382,137 +489,167 @@ class TestFCARoundTrip(unittest.TestCase):
         decode_fca(str(fca_file), str(output_dir))
         
         # Verify binary content matches
-        with open(self.test_data_dir / 'file2.bin', 'rb') as f:
-            original_content = f.read()
-        expected_md5 = hashlib.md5(original_content).hexdigest()
+        expected_md5 = _md5_path(self.test_data_dir / 'file2.bin')
         
         extracted_file = output_dir / expected_md5
         self.assertTrue(extracted_file.exists(), f"File with MD5 {expected_md5} not found")
-        with open(extracted_file, 'rb') as f:
-            self.assertEqual(f.read(), original_content)
+        self.assertEqual(_md5_path(extracted_file), expected_md5)
     
     def test_round_trip_amiibo_files(self):
         """Test round-trip with amiibo binary fixtures (test-amiibo-v2, test-amiibo-v3)."""
         amiibo_dir = Path(self.temp_dir) / 'amiibo'
         amiibo_dir.mkdir()
         for name in ('test-amiibo-v2.bin', 'test-amiibo-v3.bin'):
-            shutil.copy(self.test_data_dir / name, amiibo_dir / name)
+            _stage(self.test_data_dir / name, amiibo_dir / name)
         fca_file = Path(self.temp_dir) / 'test.fca'
         encode_fca([str(amiibo_dir)], str(fca_file))
         output_dir = Path(self.temp_dir) / 'output'
         decode_fca(str(fca_file), str(output_dir))
         for name in ('test-amiibo-v2.bin', 'test-amiibo-v3.bin'):
-            with open(self.test_data_dir / name, 'rb') as f:
-                original_content = f.read()
-            expected_md5 = hashlib.md5(original_content).hexdigest()
+            expected_md5 = _md5_path(self.test_data_dir / name)
             extracted_file = output_dir / expected_md5
             self.assertTrue(extracted_file.exists(), f"File {name} (MD5 {expected_md5}) not found")
-            with open(extracted_file, 'rb') as f:
-                self.assertEqual(f.read(), original_content)
+            self.assertEqual(_md5_path(extracted_file), expected_md5)
 
 
 class TestFCAToolParity(unittest.TestCase):
     """Parity tests between standalone scripts and unified fca_tool behavior."""
 
     def setUp(self):
-        self.temp_dir = tempfile.mkdtemp()
+        self.temp_dir = tempfile.mkdtemp(dir=_module_dir)
         self.test_data_dir = Path(__file__).parent / 'test_data'
 
-    def tearDown(self):
-        shutil.rmtree(self.temp_dir)
-
     def test_tool_encode_decode_matches_standalone(self):
         """Ensure tool encode/decode behavior matches standalone encode/decode."""
-        encode_output = Path(self.temp_dir) / 'standalone.fca'
+        # Standalone side: the shared archive of the test data and its decoded output
+        encode_output = ENCODED_TEST_DATA
         tool_output = Path(self.temp_dir) / 'tool.fca'
 
-        encode_fca([str(self.test_data_dir)], str(encode_output))
         encode_fca_from_sources(output_file=str(tool_output), input_dirs=[str(self.test_data_dir)])
 
-        with open(encode_output, 'rb') as f:
-            standalone_bytes = f.read()
-        with open(tool_output, 'rb') as f:
-            tool_bytes = f.read()
+        standalone_bytes = encode_output.read_bytes()
+        tool_bytes = tool_output.read_bytes()
 
         self.assertEqual(standalone_bytes, tool_bytes)
         self.assertGreaterEqual(standalone_bytes.count(b'FCA'), 1)
         self.assertEqual(standalone_bytes[:3], b'FCA')
 
-        decode_output_standalone = Path(self.temp_dir) / 'decode_standalone'
+        decode_output_standalone = DECODED_TEST_DATA
         decode_output_tool = Path(self.temp_dir) / 'decode_tool'
 
-        decode_fca(str(encode_output), str(decode_output_standalone))
         decode_fca(str(tool_output), str(decode_output_tool))
 
         standalone_names = sorted(p.name for p in decode_output_standalone.iterdir() if p.is_file())
         tool_names = sorted(p.name for p in decode_output_tool.iterdir() if p.is_file())
         self.assertEqual(standalone_names, tool_names)
 
+    def test_tool_deduplicates_symlinked_files(self):
+        """A walked symlink, its walked target and the same target given explicitly are archived once."""
+        src_dir = Path(self.temp_dir) / 'src'
+        src_dir.mkdir()
+        target = src_dir / 'file2.bin'
+        _stage(self.test_data_dir / 'file2.bin', target)
+        try:
+            os.symlink(target, src_dir / 'link.bin')
+        except (OSError, NotImplementedError):
+            self.skipTest("Symlinks are not supported here")
+
+        tool_output = Path(self.temp_dir) / 'tool.fca'
+        encode_fca_from_sources(output_file=str(tool_output), input_files=[str(target)], input_dirs=[str(src_dir)])
+
+        expected = _expected_archive((0x00, (self.test_data_dir / 'file2.bin').read_bytes()))
+        self.assertEqual(tool_output.read_bytes(), expected)
+
 
 class TestFCAFormat(unittest.TestCase):
     """Tests for FCA file format correctness (including embedded file types)."""
     
     def setUp(self):
-        self.temp_dir = tempfile.mkdtemp()
+        self.temp_dir = tempfile.mkdtemp(dir=_module_dir)
         self.test_data_dir = Path(__file__).parent / 'test_data'
     
-    def tearDown(self):
-        shutil.rmtree(self.temp_dir)
+    def test_embedded_file_types_match_fixtures(self):
+        """Verify each embedded file's type byte matches the known type of its source fixture."""
+        fixture_types = {
+            'test-amiibo-v2.bin': FILE_TYPE_AMIIBO_V2,
+            'test-amiibo-v3.bin': FILE_TYPE_AMIIBO_V3,
+        }
+        data = ENCODED_TEST_DATA.read_bytes()
+        magic, version = _ARCHIVE_HEADER.unpack_from(data, 0)
+        self.assertEqual(magic, b'FCA')
+        self.assertEqual(version, 1)
+        index = 0
+        for header_bytes, content in _iter_records(data):
+            file_type = header_bytes[0]
+            reserved = header_bytes[1]
+            self.assertEqual(reserved, 0x00, f"Embedded file {index + 1}: reserved byte must be 0")
+            name = os.path.basename(TEST_DATA_MD5S[hashlib.md5(content).hexdigest()])
+            expected_type = fixture_types.get(name, FILE_TYPE_UNKNOWN)
+            self.assertEqual(
+                file_type, expected_type,
+                f"Embedded file {index + 1} ({name}): stored type {file_type} != expected type {expected_type}"
+            )
+            index += 1
+        self.assertEqual(index, len(TEST_DATA_MD5S))
     
-    def test_embedded_file_types_match_detection(self):
-        """Verify each embedded file's type byte matches encoder detection."""
-        output_file = Path(self.temp_dir) / 'output.fca'
-        encode_fca([str(self.test_data_dir)], str(output_file))
-        with open(output_file, 'rb') as f:
-            self.assertEqual(f.read(3), b'FCA')
-            version = struct.unpack('>B', f.read(1))[0]
-            self.assertEqual(version, 1)
-            index = 0
-            while True:
-                total_size_bytes = f.read(4)
-                if len(total_size_bytes) < 4:
-                    break
-                total_size = struct.unpack('>I', total_size_bytes)[0]
-                header_size = struct.unpack('>H', f.read(2))[0]
-                header_bytes = f.read(header_size)
-                embedded_size = total_size - 2 - header_size
-                content = f.read(embedded_size)
-                file_type = header_bytes[0]
-                reserved = header_bytes[1]
-                self.assertEqual(reserved, 0x00, f"Embedded file {index + 1}: reserved byte must be 0")
-                expected_type = detect_file_type(content)
-                self.assertEqual(
-                    file_type, expected_type,
-                    f"Embedded file {index + 1}: stored type {file_type} != detected type {expected_type}"
-                )
-                index += 1
-            self.assertGreater(index, 0, "Expected at least one embedded file")
+    def test_detect_file_type_from_prefix(self):
+        """Detection on the sniffed prefix plus total size matches detection on full content."""
+        lego = bytearray(180)
+        lego[0] = 0x04
+        lego[7] = 0x80
+        samples = [bytes(lego)]
+        for test_file in sorted(entry.path for entry in _walk_files(self.test_data_dir)):
+            samples.append(Path(test_file).read_bytes())
+        for content in samples:
+            self.assertEqual(
+                detect_file_type(content[:DETECT_SNIFF_SIZE], size=len(content)),
+                detect_file_type(content),
+            )
     
     def test_amiibo_fixtures_have_correct_types(self):
         """Verify test-amiibo-v2.bin and test-amiibo-v3.bin get types 1 and 2."""
         amiibo_dir = Path(self.temp_dir) / 'amiibo'
         amiibo_dir.mkdir()
-        shutil.copy(self.test_data_dir / 'test-amiibo-v2.bin', amiibo_dir / 'test-amiibo-v2.bin')
-        shutil.copy(self.test_data_dir / 'test-amiibo-v3.bin', amiibo_dir / 'test-amiibo-v3.bin')
+        _stage(self.test_data_dir / 'test-amiibo-v2.bin', amiibo_dir / 'test-amiibo-v2.bin')
+        _stage(self.test_data_dir / 'test-amiibo-v3.bin', amiibo_dir / 'test-amiibo-v3.bin')
         output_file = Path(self.temp_dir) / 'output.fca'
         encode_fca([str(amiibo_dir)], str(output_file))
-        with open(output_file, 'rb') as f:
-            self.assertEqual(f.read(3), b'FCA')
-            self.assertEqual(struct.unpack('>B', f.read(1))[0], 1)
-            # First embedded file (v2)
-            total_size = struct.unpack('>I', f.read(4))[0]
-            header_size = struct.unpack('>H', f.read(2))[0]
-            header_bytes = f.read(header_size)
-            f.read(total_size - 2 - header_size)
-            self.assertEqual(header_bytes[0], FILE_TYPE_AMIIBO_V2, "test-amiibo-v2.bin should have type Amiibo v2 (1)")
-            self.assertEqual(header_bytes[1], 0x00)
-            # Second embedded file (v3)
-            total_size = struct.unpack('>I', f.read(4))[0]
-            header_size = struct.unpack('>H', f.read(2))[0]
-            header_bytes = f.read(header_size)
-            f.read(total_size - 2 - header_size)
-            self.assertEqual(header_bytes[0], FILE_TYPE_AMIIBO_V3, "test-amiibo-v3.bin should have type Amiibo v3 (2)")
-            self.assertEqual(header_bytes[1], 0x00)
+        expected = _expected_archive(
+            (FILE_TYPE_AMIIBO_V2, (self.test_data_dir / 'test-amiibo-v2.bin').read_bytes()),
+            (FILE_TYPE_AMIIBO_V3, (self.test_data_dir / 'test-amiibo-v3.bin').read_bytes()),
+        )
+        self.assertEqual(
+            output_file.read_bytes(), expected,
+            "Expected test-amiibo-v2.bin as Amiibo v2 (1), then test-amiibo-v3.bin as Amiibo v3 (2)"
+        )
+
+
+
+class TestBuildIcon(unittest.TestCase):
+    """Tests for PNG to ICO conversion."""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def test_non_square_png_keeps_all_sizes(self):
+        """A non-square source still produces every ICO size."""
+        try:
+            from PIL import Image
+        except ImportError:
+            self.skipTest("Pillow is not installed")
+        from build_icon import ICO_SIZES, convert_png_to_ico
+        
+        png_file = Path(self.temp_dir) / 'icon.png'
+        Image.new('RGBA', (512, 256), (255, 0, 0, 255)).save(png_file)
+        
+        ico_file = Path(self.temp_dir) / 'icon.ico'
+        convert_png_to_ico(png_file, ico_file)
+        
+        with Image.open(ico_file) as ico:
+            self.assertLessEqual(set(ICO_SIZES), set(ico.info['sizes']))
 
 
 if __name__ == '__main__':